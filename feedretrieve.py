@@ -32,22 +32,40 @@ _PROG_INFO = """
 import argparse
 import atexit
 import calendar
+import gzip
+import hashlib
 import itertools
+import json
 import logging
 import logging.handlers
 import os
 import re
+import shutil
+import socket
+import string
 import sys
 import time
+import zlib
+from contextlib import closing
 if sys.version_info.major == 2:
     import ConfigParser as configparser
     import urllib2 as urlreq
+    from urlparse import urlparse
 elif sys.version_info.major == 3:
     import configparser
     import urllib.request as urlreq
+    from urllib.parse import urlparse
 else:
     print("Unknow Python version: %s" % (sys.version_info,))
     sys.exit(1)
+try:
+    import lzma
+except ImportError:
+    lzma = None # python 2
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 try:
     import importlib
     import_module = importlib.import_module
@@ -85,7 +103,16 @@ class Config:
     plugin_path = os.path.join(os.path.expanduser('~'),
                                '.feedretrieve_plugins')
     user_agent = 'feedretrieve.py/{}'.format(_VERSION)
+    # consecutive connection failures after which a host is skipped,
+    # and seconds to wait before trying it again
+    breaker_threshold = 3
+    breaker_cooldown = 300
+    compress = 'none' # saved pages' compression, see COMPRESSIONS
     delay = 0
+    # raw feeds' cache (disabled if empty), max size in bytes
+    feed_cache = ''
+    feed_cache_size = 50 * 1024 * 1024
+    priority = 1.0 # sections' default weight with --cycle-budget
     timeout = None # use default timeout
     # strings substitutions, regex pattern : sub #
     if sys.version_info.major == 2:
@@ -94,23 +121,42 @@ class Config:
     else:
         re_subs = {'[ ,/|:"‘’“”«″–′\']': '-',
                    '[()]': '_', }
+    # default template for the saved files' names (see TitleTemplate)
+    title_template = '{prefix}{title}{suffix}_{year}{month:02d}{day:02d}.{ext}'
     class Fields:
+        breaker_threshold = 'breaker_threshold'
+        breaker_cooldown = 'breaker_cooldown'
+        compress = 'compress'
+        feed_cache = 'feed_cache'
+        feed_cache_compress = 'feed_cache_compress'
+        feed_cache_size = 'feed_cache_size'
         feed_url = 'feed_url'
         save_path = 'savepath'
         last_update = 'last_update_time'
+        # sections' history, see SectionStats
+        last_poll = 'last_poll_time'
+        poll_duration = 'poll_duration'
+        poll_news = 'poll_news'
         delay = 'delay'
         prefix = 'prefix'
+        priority = 'priority'
         suffix = 'suffix'
         ext = 'ext'
         timeout = 'timeout'
         user_agent = 'user_agent'
         recovery_file = 'recovery_file'
+        title_template = 'title_template'
         time_keys = ('updated_parsed', 'date_parsed', 'published_parsed')
         # entry key which will be added and used to compare date (got
         # the values of the first available keys of time_keys)
         compare_time = '__date'
 
 
+# saved pages' compression => (file suffix, open function)
+COMPRESSIONS = {'none': ('', open), 'gzip': ('.gz', gzip.open)}
+if lzma is not None:
+    COMPRESSIONS['lzma'] = ('.xz', lzma.open)
+
 CONFIG_FILE_EXAMPLE = """
 #-------------------------------------------------#
 # example of config file.
@@ -125,6 +171,16 @@ ext = html
 timeout = 
 user_agent = {user_agent}
 recovery_file = {rec_file}
+breaker_threshold = {breaker_threshold}
+breaker_cooldown = {breaker_cooldown}
+# directory for the raw feeds' cache (see --replay), empty to disable
+feed_cache = {feed_cache}
+feed_cache_size = {feed_cache_size}
+feed_cache_compress = no
+# compression of the saved pages: gzip, lzma or none
+compress = none
+# available fields: title, year, month, day and any config value
+title_template = {title_template}
 
 [uaar]
 savepath = /home/crap0101/feeds/uaarnews/
@@ -136,9 +192,17 @@ savepath = /home/crap0101/feeds/comidad/
 feed_url = http://www.comidad.org/dblog/feedrss.asp
 last_update_time = 1301529687  # after some time
 prefix = xxx_
+# weight used with --cycle-budget (default 1)
+priority = 2
 
 """.format(user_agent=Config.user_agent,
-           rec_file=Config.recovery_file)
+           rec_file=Config.recovery_file,
+           breaker_threshold=Config.breaker_threshold,
+           breaker_cooldown=Config.breaker_cooldown,
+           feed_cache=os.path.join(os.path.expanduser('~'),
+                                   '.feedretrieve_cache'),
+           feed_cache_size=Config.feed_cache_size,
+           title_template=Config.title_template)
 
 RECOVERY_FILE_EXAMPLE = """
 #------------------------#
@@ -150,13 +214,315 @@ destination-path-1
 
 url-2
 destination-path-2
+gzip
 
+(the optional third line is the compression used for the
+destination file, see the compress config value, default none)
 """
 
+class Entry (Mapping):
+    """Compact record of a feed entry, holding only what is needed
+    for saving it, so the (possibly big) FeedParserDict objects can be
+    released as soon as possible.
+    Values are reachable both as attributes and as mapping's items
+    (like a FeedParserDict) so title's formatting functions can use
+    both; the date is also reachable using the Config.Fields.time_keys
+    and Config.Fields.compare_time names.
+    """
+    __slots__ = ('title', 'link', 'link_type', 'id', 'date')
+    _aliases = dict(
+        [(k, 'date') for k in Config.Fields.time_keys]
+        + [(Config.Fields.compare_time, 'date'), ('type', 'link_type')])
+
+    def __init__(self, title, link, link_type, id, date):
+        self.title = title
+        self.link = link
+        self.link_type = link_type
+        self.id = id
+        self.date = date
+
+    @classmethod
+    def from_feed(cls, entry):
+        """Returns a new Entry from the FeedParserDict *entry*.
+        The date is the value of the first available key of
+        Config.Fields.time_keys, or None.
+        """
+        date = None
+        for k in Config.Fields.time_keys:
+            if k in entry:
+                date = entry[k]
+                break
+        links = entry.get('links') or [{}]
+        link = entry.get('link', '')
+        return cls(entry.get('title', ''), link, links[0].get('type', ''),
+                   entry.get('id') or link, date)
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self, self._aliases[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        name = self._aliases.get(key, key)
+        if name not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, name)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+                '{}={!r}'.format(k, getattr(self, k)) for k in self))
+
+
+class FeedCache (object):
+    """On-disk cache of the raw feeds' documents.
+    Each document is stored with the response's headers in a file
+    named after the url's hash and the retrieving time, optionally
+    gzip-compressed. When the total size exceeds *max_size* bytes,
+    the least recently used files are removed.
+    """
+    def __init__(self, path, max_size=Config.feed_cache_size,
+                 compress=False):
+        self.path = path
+        self.max_size = max_size
+        self.compress = compress
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _key(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _parse(self, name):
+        """Returns the (key, time) pair of the cache file *name*,
+        or None if it isn't a cache file's name.
+        """
+        parts = name.split('.')
+        if parts[1:] in (['feed'], ['feed', 'gz']):
+            key, _, when = parts[0].partition('_')
+            if when.isdigit():
+                return key, int(when)
+        return None
+
+    def _files(self):
+        """Yields (name, key, time) for each cache file."""
+        for name in os.listdir(self.path):
+            parsed = self._parse(name)
+            if parsed is not None:
+                yield (name,) + parsed
+
+    def evict(self):
+        """Remove the temporary files left by an interrupted store()
+        and the least recently used files until the cache size is
+        no more than max_size.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp') and self._parse(name[:-4]):
+                logging.debug('removing stale cache file {}'.format(name))
+                os.remove(os.path.join(self.path, name))
+        files = []
+        for name, _, _ in self._files():
+            path = os.path.join(self.path, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            logging.debug('removing cached feed {}'.format(path))
+            os.remove(path)
+            total -= size
+
+    def load(self, url, when=None):
+        """Returns the (body, headers) pair of the latest document
+        cached for *url* (not after the *when* time, if given)
+        or None.
+        Unreadable files are skipped, falling back to older ones.
+        """
+        key = self._key(url)
+        found = [(t, name) for name, k, t in self._files()
+                 if k == key and (when is None or t <= when)]
+        for _, name in sorted(found, reverse=True):
+            path = os.path.join(self.path, name)
+            opener = gzip.open if path.endswith('.gz') else open
+            try:
+                with opener(path, 'rb') as f:
+                    meta = json.loads(f.readline().decode('utf-8'))
+                    body = f.read()
+                headers = meta['headers']
+                os.utime(path, None) # mark as recently used
+            except (EnvironmentError, EOFError, KeyError,
+                    TypeError, ValueError, zlib.error) as err:
+                logging.warning('Bad cached feed {}: {}'.format(path, err))
+                continue
+            return body, headers
+        return None
+
+    def store(self, url, body, headers, when=None):
+        """Cache the *body* document and *headers* mapping
+        retrieved from *url* at the time *when* (default to now).
+        """
+        when = int(time.time() if when is None else when)
+        name = '{}_{}.feed'.format(self._key(url), when)
+        if self.compress:
+            name += '.gz'
+        path = os.path.join(self.path, name)
+        meta = json.dumps({'url': url, 'time': when, 'headers': headers})
+        with (gzip.open if self.compress else open)(path + '.tmp', 'wb') as f:
+            f.write(meta.encode('utf-8') + b'\n')
+            f.write(body)
+        os.rename(path + '.tmp', path)
+        self.evict()
+
+
+class DirListing (object):
+    """Names of the files in some directories, read once for each
+    directory (using os.scandir, if available) for making cheap the
+    "already saved" checks. Must be updated with add() when files are
+    written, and emptied with clear() for reading the directories again.
+    """
+    def __init__(self):
+        self._dirs = {} # absolute path => set of names
+
+    def _names(self, directory):
+        directory = os.path.abspath(directory)
+        try:
+            return self._dirs[directory]
+        except KeyError:
+            try:
+                if hasattr(os, 'scandir'):
+                    names = set(e.name for e in os.scandir(directory))
+                else:
+                    names = set(os.listdir(directory))
+            except OSError:
+                names = set()
+            self._dirs[directory] = names
+            return names
+
+    def add(self, path):
+        """Record that *path* exists."""
+        directory, name = os.path.split(path)
+        self._names(directory).add(name)
+
+    def clear(self):
+        """Forget the directories' content."""
+        self._dirs.clear()
+
+    def exists(self, path):
+        """Returns True if *path* exists."""
+        directory, name = os.path.split(path)
+        return name in self._names(directory)
+
+
+class RecoveryWriter (object):
+    """Writes recovery entries in batches to a new file,
+    which replaces the one at *recfile_path* on commit().
+    """
+    batch_size = 512
+
+    def __init__(self, recfile_path):
+        self.path = recfile_path
+        self.new_path = recfile_path + '.new'
+        self.count = 0
+        self._batch = []
+        self._file = open(self.new_path, 'wb')
+
+    def abort(self):
+        """Discard the written entries, leaving the old file untouched."""
+        self._file.close()
+        os.remove(self.new_path)
+
+    def commit(self):
+        """Replace the old file with the new one
+        (or remove it, if no entries were written).
+        """
+        self.flush()
+        self._file.flush()
+        os.fsync(self._file.fileno()) # on disk before the replacement
+        self._file.close()
+        if self.count:
+            getattr(os, 'replace', os.rename)(self.new_path, self.path)
+        else:
+            os.remove(self.new_path)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def flush(self):
+        """Write the pending entries."""
+        self._file.write(b''.join(self._batch))
+        self._batch = []
+
+    def write(self, url, destination, compress=None):
+        """Add an entry (see write_recovery_entry())."""
+        self._batch.append(_recovery_entry(url, destination, compress))
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+
 class SaveError (Exception):
     """Exception on saving"""
     pass
 
+
+class HostBreaker (object):
+    """Per-host circuit breaker.
+    After *threshold* consecutive connection failures the circuit
+    for the host opens and allow() returns False, until *cooldown*
+    seconds are passed; then a single try is allowed (half-open)
+    which closes the circuit if succeed or opens it again if fails.
+    """
+    def __init__(self, threshold=Config.breaker_threshold,
+                 cooldown=Config.breaker_cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {} # host => consecutive failures
+        self._opened = {}   # host => time of the circuit opening
+
+    def allow(self, host):
+        """Returns True if a connection to *host* can be tried."""
+        opened = self._opened.get(host)
+        if opened is None:
+            return True
+        if time.time() - opened >= self.cooldown:
+            # half-open, wait again until the try reports back
+            self._opened[host] = time.time()
+            logging.info('trying again host {}'.format(host))
+            return True
+        return False
+
+    def failure(self, host):
+        """Record a connection failure for *host*."""
+        failures = self._failures[host] = self._failures.get(host, 0) + 1
+        if failures >= self.threshold:
+            if host not in self._opened:
+                logging.warning(
+                    'host {} unreachable, skipping it for {} sec'.format(
+                        host, self.cooldown))
+            self._opened[host] = time.time()
+
+    def state(self, host):
+        """Returns the state of the *host*'s circuit:
+        'closed', 'open' or 'half-open'.
+        """
+        opened = self._opened.get(host)
+        if opened is None:
+            return 'closed'
+        if time.time() - opened >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def success(self, host):
+        """Record a succesfull connection to *host*."""
+        self._failures.pop(host, None)
+        if self._opened.pop(host, None) is not None:
+            logging.info('host {} is back'.format(host))
+
 def positive_integer (arg):
     """Function for the -t/--timeout argument.
     Returns the converted arg or Raise
@@ -167,24 +533,101 @@ def positive_integer (arg):
         raise argparse.ArgumentTypeError("Must be a positive integer")
     return value
 
+def compile_subs(subs):
+    """
+    Returns a function which applies the substitutions from the
+    *subs* mapping of {regex pattern: replacement} to a string
+    in a single pass. Patterns must not contain capturing groups.
+    """
+    if not subs:
+        return lambda string: string
+    patterns, repls = zip(*subs.items())
+    regex = re.compile(u'|'.join(u'(' + p + u')' for p in patterns), re.U)
+    def translate(string):
+        return regex.sub(lambda match: repls[match.lastindex - 1], string)
+    return translate
+
+_translate_title = compile_subs(Config.re_subs)
+
+
+_formatter = string.Formatter()
+
+
+class _TitleFields (object):
+    """Mapping of an entry's fields over the section's ones,
+    for not copying the latter for every entry.
+    """
+    __slots__ = ('entry', 'section')
+
+    def __init__(self, entry, section):
+        self.entry = entry
+        self.section = section
+
+    def __getitem__(self, key):
+        try:
+            return self.entry[key]
+        except KeyError:
+            return self.section[key]
+
+
+class TitleTemplate (object):
+    """Filename's template, resolved once for a config section.
+    The template (the section's title_template value or the default
+    Config.title_template) is a format string which can use the fields
+    title (with the Config.re_subs substitutions applied), year,
+    month, day and any value from the section.
+    """
+    def __init__(self, section_items):
+        self.fields = dict(section_items)
+        self.template = (self.fields.get(Config.Fields.title_template)
+                         or Config.title_template)
+        try:
+            self._format(title='', year=1970, month=1, day=1)
+        except (AttributeError, IndexError, KeyError,
+                TypeError, ValueError) as err:
+            logging.error("Bad title_template {!r} ({}: {}), "
+                          "using the default one".format(
+                    self.template, err.__class__.__name__, err))
+            self.template = Config.title_template
+
+    def _format(self, **entry_fields):
+        return _formatter.vformat(self.template, (),
+                                  _TitleFields(entry_fields, self.fields))
+
+    def format(self, entry):
+        """Returns the formatted title of *entry*."""
+        date = entry.date
+        return self._format(title=_translate_title(entry.title),
+                            year=date.tm_year, month=date.tm_mon,
+                            day=date.tm_mday)
+
+
+class TitleFormatter (object):
+    """Formats entries' titles for a config section using *format_func*.
+    The section's values are read once, so a new instance must be made
+    at each poll.
+    """
+    def __init__(self, format_func, section_items):
+        self.section_items = dict(section_items)
+        if format_func is _format_title:
+            self._format = TitleTemplate(self.section_items).format
+        else:
+            self._format = lambda entry: format_func(entry,
+                                                     self.section_items)
+
+    def __call__(self, entry):
+        return self._format(entry)
+
+
 #default function for filename's string formatting
 def _format_title(entry, section_items):
     """
-    entry => FeedParserDict object,
+    entry => Entry object,
     section_items => mapping of key,value pairs from the
                      config file section for this entry
-    Returns the formatted title.
+    Returns the formatted title (see TitleTemplate).
     """
-    title = entry.title
-    for pattern, sub in Config.re_subs.items():
-        title = re.sub(pattern, sub, title, re.U)
-    date = entry.updated_parsed
-    prefix = section_items[Config.Fields.prefix]
-    suffix = section_items[Config.Fields.suffix]
-    ext = section_items[Config.Fields.ext]
-    return ("%s%s%s_%d%02d%02d.%s" %
-            (prefix, title, suffix, date.tm_year,
-             date.tm_mon, date.tm_mday, ext))
+    return TitleTemplate(section_items).format(entry)
 
 @atexit.register
 def _atexit_log():
@@ -199,19 +642,11 @@ def add_headers(opener, headers):
 
 
 def feeds_from_urls (urls, dest, timeout=None):
-    for url in urls:
-        logging.info('start retrive pages from {}'.format(url))
-        entries = get_entries(url)
-        if not entries:
-            logging.info('no entries from {}'.format(url))
-        for e in entries:
-            logging.info('saving {title} [{type}]'.format(
-                    title=e.title,
-                    type=e.links[0].type))
-            try:
-                save(e.link, os.path.join(dest, e.title), timeout)
-            except SaveError as err:
-                pass
+    """Save all the entries from the feeds at *urls* in *dest*."""
+    with closing(FeedRetriever(None, timeout=timeout,
+                               opener=InstalledOpener())) as retriever:
+        for _ in retriever.poll_urls(urls, dest):
+            pass
 
 
 def get_arg_parser():
@@ -224,6 +659,17 @@ def get_arg_parser():
                         dest='cfg', default=Config.config_file, metavar='PATH',
                         help='''path to the the config file to read from,
                               default to %(default)s''')
+    parser.add_argument('--cycle-budget',
+                        dest='cycle_budget', default=0, metavar='SECONDS',
+                        type=positive_integer,
+                        help='''spend at most %(metavar)s seconds for each
+                             retrieving cycle: sections are processed by
+                             priority (the config file's priority value,
+                             the time since the last retrieving and the
+                             usual number of new entries) and the work which
+                             doesn't fit is deferred to the next cycle or
+                             to the recovery file. Zero (the default) means
+                             no limit''')
     parser.add_argument('-d', '--destination',
                         dest='dest', default='', metavar='PATH',
                         help='''set %(metavar)s to the directory for the
@@ -233,7 +679,9 @@ def get_arg_parser():
                         dest='ffunc', metavar='module.func',
                         help='''"Use the module's function func from the plugin
                         dir ({}) for title's formatting. Arguments passed to
-                        custom functions are a FeedParserDict object and a
+                        custom functions are an Entry object (supporting
+                        attribute and mapping access, like a FeedParserDict)
+                        and a
                         mapping of key,value configuration items from the
                         relative section. The function must returns the
                         formatted title'''.format(Config.plugin_path))
@@ -256,6 +704,16 @@ def get_arg_parser():
                              value recovery_file, if present, otherwise
                              fall back to the default one: {}).
                              '''.format(Config.recovery_file))
+    parser.add_argument('--replay',
+                        dest='replay', nargs='?', const=0, metavar='TIME',
+                        type=positive_integer,
+                        help='''don't use the network: read the feeds from the
+                             cache (see the feed_cache config value), take
+                             all their entries as new and only log the
+                             files which would be saved. If %(metavar)s
+                             (seconds since the epoch) is given, use the
+                             feeds cached not after it, otherwise the
+                             latest ones''')
     parser.add_argument('-s', '--sections',
                         dest='sections', default=(), nargs='+',
                         metavar='SECTIONS', help='''retrieve feeds only from
@@ -295,9 +753,61 @@ def get_format_func (path, module, func):
     return getattr(m, func)
 
 
-def get_entries(url):
-    """Returns the entries from the given url."""
-    return feedparser.parse(url).entries
+def get_entries(url, opener=None, timeout=None, cache=None):
+    """Returns the entries from the given url.
+    If *opener* is given, use it for downloading the feed
+    (timeout as in save()), otherwise let feedparser fetch it
+    (as for non-http urls, like local paths).
+    If *cache* (a FeedCache object) is given, the downloaded
+    document is stored in it (*opener* is needed).
+    """
+    if opener is None or urlparse(url).scheme not in ('http', 'https'):
+        return feedparser.parse(url).entries
+    try:
+        with closing(opener.open(url, timeout=timeout)) as data:
+            body = data.read()
+            headers = dict((k.lower(), v) for k, v in data.info().items())
+    except Exception as err:
+        # like feedparser.parse(url), never raise
+        logging.error('in get_entries() -- {}: {}'.format(err, url))
+        return []
+    if cache is not None:
+        try:
+            cache.store(url, body, headers)
+        except (IOError, OSError) as err:
+            logging.error('in get_entries() -- caching {}: {}'.format(
+                    url, err))
+    return feedparser.parse(body, response_headers=headers).entries
+
+
+def iter_recovery(recfile_path, unique=True, errors=None):
+    """Lazily yields the (url,path,compress) triplets from recfile,
+    skipping the duplicated url,path pairs if *unique* is true.
+    compress is 'none' for entries without it. Bad formatted entries
+    are logged and, if *errors* (a list) is given, appended to it.
+    """
+    seen = set() # digests of the yielded pairs
+    with open(recfile_path, 'rb') as f:
+        for blank, g in itertools.groupby(f, lambda x: not x.strip()):
+            if blank:
+                continue
+            group = list(x.decode("utf-8") for x in g)
+            entry = [x.strip() for x in group]
+            if len(entry) == 2:
+                entry.append('none')
+            if len(entry) != 3 or entry[2] not in COMPRESSIONS:
+                logging.warning(
+                    "Skipping {}: Bad formatted entry".format(group))
+                if errors is not None:
+                    errors.append(group)
+                continue
+            if unique:
+                digest = hashlib.sha1(
+                    '\n'.join(entry[:2]).encode('utf-8')).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+            yield tuple(entry)
 
 
 def read_config(filepath):
@@ -308,40 +818,23 @@ def read_config(filepath):
 
 
 def read_recovery(recfile_path):
-    """Returns a sequence of (url,path) pairs from recfile."""
-    to_rec = []
+    """Returns a sequence of (url,path) pairs from recfile
+    and a sequence of the bad formatted entries.
+    """
     errors = []
-    with open(recfile_path, 'rb') as f:
-        for k, g in itertools.groupby(f, lambda x: not x.strip()):
-            group = list(x.decode("utf-8") for x in g)
-            if ''.join(group).strip():
-                if len(group) != 2:
-                    logging.warning(
-                        "Skipping {}: Bad formatted entry".format(group))
-                    errors.append(group)
-                else:
-                    to_rec.append(tuple(x.strip() for x in group))
+    to_rec = [(url, path) for url, path, _
+              in iter_recovery(recfile_path, False, errors)]
     return to_rec, errors
 
 
 def retrieve_news(entries, last_struct_time=time.gmtime(0)):
-    """Yelds new feed entries."""
-    def check_time_attr (entry):
-        if not set(entry.keys()) & set(Config.Fields.time_keys):
-            logging.info("Can't save %s (no date fields)." % entry.link)
-            return False
-        return True
-    def is_new (entry, last_time):
-        return entry[Config.Fields.compare_time] > last_time
-    entries = list(filter(check_time_attr, entries))
-    for e in entries:
-        for k in Config.Fields.time_keys:
-            if k in e:
-                e[Config.Fields.compare_time] = e[k]
-                break
+    """Yields an Entry for each new feed entry."""
     for e in entries:
-        if is_new(e, last_struct_time):
-            yield e
+        entry = Entry.from_feed(e)
+        if entry.date is None:
+            logging.info("Can't save %s (no date fields)." % entry.link)
+        elif entry.date > last_struct_time:
+            yield entry
 
 
 def run(config_file, recfile, format_title_func, sections=(), timeout=None):
@@ -349,60 +842,45 @@ def run(config_file, recfile, format_title_func, sections=(), timeout=None):
     section => a sequence of strings, cfg section's names.
                If False, retrive all found sections.
     """
-    cfg = read_config(config_file)
-    if not sections:
-        sections = list(cfg.sections())
-    for section in set(cfg.sections()).intersection(sections):
-        url = cfg.get(section, Config.Fields.feed_url)
-        info = get_entries(url)
-        if not info:
-            logging.info('no entries from {}'.format(url))
-            continue
-        entries = list(retrieve_news(info, time_to_struct(
-                    float(cfg.get(section,Config.Fields.last_update)))))
-        if entries:
-            logging.info('start retrive pages from {}'.format(section))
-            for e in entries:
-                logging.info('saving {title} [{type}]'.format(
-                        title=e.title,
-                        type=e.links[0].type))
-                try:
-                    save(e.link,
-                         os.path.join(
-                            cfg.get(section, Config.Fields.save_path),
-                            format_title_func(e, dict(cfg.items(section)))),
-                         timeout)
-                except SaveError as err:
-                    write_recovery_entry(recfile,
-                                         e.link,
-                                         os.path.join(
-                            cfg.get(section, Config.Fields.save_path),
-                            format_title_func(e, dict(cfg.items(section)))))
-            write_config(config_file, section,
-                         [(Config.Fields.last_update,
-                           str(struct_to_time(
-                               max(e.updated_parsed for e in entries))))])
+    retriever = FeedRetriever(config_file, recfile, format_title_func,
+                              timeout, opener=InstalledOpener())
+    with closing(retriever):
+        retriever.poll(sections)
 
 def struct_to_time(struct_time):
     """Convert *struct_time* to calendar.timegm."""
     return calendar.timegm(struct_time)
 
 
-def save(url, dest, timeout=None):
+def save(url, dest, timeout=None, opener=None,
+         exists=os.path.exists, compress='none'):
     """
     Save the content downloaded from *url* in the path *basepath*
     in a file named *title*.
     optional timeout is the used as argument for urlopen (must be a
     positive integer or None, which means to use the default timeout).
+    optional opener is the OpenerDirector used for the download
+    (default to the one installed with set_headers).
+    optional exists is the function used for checking if dest
+    has been already saved (see saved_path()).
+    optional compress is the compression (a COMPRESSIONS key) used
+    for writing dest, whose suffix must be already in dest.
+    Returns True if the file has been downloaded, False if was
+    already saved.
     """
-    if os.path.exists(dest):
-        logging.info('* alredy saved: {}'.format(dest))
-        return
-    with open(dest, 'wb') as news:
+    found = saved_path(dest, exists, compress)
+    if found:
+        logging.info('* alredy saved: {}'.format(found))
+        return False
+    with COMPRESSIONS[compress][1](dest, 'wb') as news:
         try:
             logging.debug("from url {}".format(url))
-            data = urlreq.urlopen(url, timeout=timeout)
-            news.write(data.read())
+            if opener is None:
+                data = urlreq.urlopen(url, timeout=timeout)
+            else:
+                data = opener.open(url, timeout=timeout)
+            with closing(data):
+                shutil.copyfileobj(data, news)
             logging.debug("Saved file: {} [{}]".format(
                     dest, filetype(dest).decode('utf-8')))
         except IOError as err:
@@ -414,25 +892,28 @@ def save(url, dest, timeout=None):
             except OSError:
                 pass # no dest file was even created
             raise SaveError(err)
+    return True
 
 
 def save_from_recovery (recfile, timeout=None):
     """Save uris stored in the recovery file."""
-    if not os.path.exists(recfile):
-        logging.info("No recovery file found, skip...")
-        return
-    try:
-        data, errors = read_recovery(recfile) #TODO: wtf with errors?
-        os.remove(recfile)
-    except IOError as e:
-        logging.info("Error while reading recovery file {}, skip...".format(e))
-        return
-    logging.info("Start retrieve urls to be recovered...")
-    for url, path in data:
-        try:
-            save(url, path, timeout)
-        except SaveError as err:
-            write_recovery_entry(recfile, url, path)
+    with closing(FeedRetriever(None, recfile, timeout=timeout,
+                               opener=InstalledOpener())) as retriever:
+        retriever.recover()
+
+
+def saved_path(dest, exists=os.path.exists, compress='none'):
+    """Returns the path of the file already saved for *dest*, either
+    compressed or not (see COMPRESSIONS), or None if there is none.
+    *exists* is the function used for checking the paths, *compress*
+    the compression whose suffix is in dest.
+    """
+    suffix = COMPRESSIONS[compress][0]
+    base = dest[:len(dest) - len(suffix)]
+    for suffix, _ in COMPRESSIONS.values():
+        if exists(base + suffix):
+            return base + suffix
+    return None
 
 
 def set_headers(headers):
@@ -472,65 +953,522 @@ def write_config(filepath, section, pairs):
             config.set(section, key, str(value))
         config.write(config_file)
 
-def write_recovery_entry (recovery_path, url, destination):
+def _recovery_entry (url, destination, compress=None):
+    """Returns the recovery file's entry for url and destination."""
+    if compress in (None, 'none'):
+        return "{}\n{}\n\n".format(url, destination).encode("utf-8")
+    return "{}\n{}\n{}\n\n".format(
+        url, destination, compress).encode("utf-8")
+
+def write_recovery_entry (recovery_path, url, destination, compress=None):
+    """Append an entry to the recovery file. *compress* is the
+    compression of destination (see COMPRESSIONS), if any.
+    """
     with open(recovery_path, 'a+b') as rec:
-        rec.write("{}\n{}\n\n".format(url, destination).encode("utf-8"))
+        rec.write(_recovery_entry(url, destination, compress))
+
+
+class SectionStats (object):
+    """History of a section's polls, used for prioritizing it.
+    duration and news are exponential moving averages of the time
+    taken and the number of new entries. The history is kept in
+    the section's config values (see from_config() and items()).
+    """
+    __slots__ = ('last_poll', 'duration', 'news', 'polled')
+    smoothing = 0.5
+
+    def __init__(self):
+        self.last_poll = 0
+        self.duration = 0.0
+        self.news = 0.0
+        self.polled = False
+
+    @classmethod
+    def from_config(cls, cfg, section):
+        """Returns the stats read from the *section* of the *cfg*
+        ConfigParser object. If never polled, the time of the last
+        retrieved entry (if any) is used as the last poll's time.
+        """
+        def get(key, default):
+            if cfg.has_option(section, key):
+                try:
+                    return float(cfg.get(section, key))
+                except ValueError:
+                    pass
+            return default
+        stats = cls()
+        stats.last_poll = get(Config.Fields.last_poll,
+                              get(Config.Fields.last_update, 0))
+        stats.duration = get(Config.Fields.poll_duration, 0.0)
+        stats.news = get(Config.Fields.poll_news, 0.0)
+        stats.polled = cfg.has_option(section, Config.Fields.poll_duration)
+        return stats
+
+    def items(self):
+        """Returns the (key, value) config pairs of the stats."""
+        return [(Config.Fields.last_poll, str(int(self.last_poll))),
+                (Config.Fields.poll_duration, str(round(self.duration, 3))),
+                (Config.Fields.poll_news, str(round(self.news, 3)))]
+
+    def update(self, duration, news):
+        """Record a poll which took *duration* seconds
+        and found *news* new entries.
+        """
+        if self.polled:
+            a = self.smoothing
+            self.duration = a * duration + (1 - a) * self.duration
+            self.news = a * news + (1 - a) * self.news
+        else:
+            self.duration = float(duration)
+            self.news = float(news)
+        self.polled = True
+        self.last_poll = time.time()
+
+
+class InstalledOpener (object):
+    """Opener-like object using the globally installed opener (see
+    set_headers()), for the module-level functions which predate
+    FeedRetriever.
+    """
+    def close(self):
+        pass
+
+    def open(self, url, timeout=None):
+        return urlreq.urlopen(url, timeout=timeout)
+
+
+class FeedRetriever (object):
+    """Retrieve feeds from the sections of a config file.
+
+    An instance owns its configuration, url opener, recovery file,
+    timeout and title formatting function, so it can be kept alive
+    by a long-running process and reused for many polls, instead of
+    relying on the module's global state (see set_headers()).
+    Call close() when done (or use contextlib.closing).
+    Note that urllib's openers don't keep the connections alive:
+    each request opens a new one, only the opener's handlers, the
+    caches and the hosts' and sections' history are reused.
+    """
+    def __init__(self, config_file=Config.config_file, recfile='',
+                 format_func=None, timeout=None, user_agent='',
+                 replay=False, opener=None, replay_time=None):
+        """
+        config_file => path to the config file, if None don't read
+                       any config file.
+        recfile     => path to the recovery file, if empty use the
+                       config file's value or the default one.
+        format_func => function for title's formatting (see _format_title).
+        timeout     => the timeout for the connections, if None use
+                       the config file's value or the default one.
+        user_agent  => if empty, use the config file's value
+                       or the default one.
+        replay      => if True, read the feeds from the feed_cache
+                       directory instead of the network, consider new
+                       all their entries and don't save anything, only
+                       log and yield what would be saved.
+        replay_time => when replaying, use the feeds cached not after
+                       this time (seconds since the epoch) instead
+                       of the latest ones.
+        opener      => the opener (an OpenerDirector or alike) to use,
+                       which is left open by close(); if None, use a new
+                       one with the *user_agent* header.
+        """
+        self.config_file = config_file
+        self.breaker = HostBreaker()
+        self.feed_cache = None
+        self.reload()
+        defaults = self.cfg.defaults()
+        self.recfile = (recfile
+                        or defaults.get(Config.Fields.recovery_file,
+                                        Config.recovery_file)
+                        or Config.recovery_file)
+        self.timeout = (timeout
+                        or int(defaults.get(Config.Fields.timeout, 0) or 0)
+                        or Config.timeout)
+        self.format_func = format_func or _format_title
+        user_agent = (user_agent
+                      or defaults.get(Config.Fields.user_agent,
+                                      Config.user_agent)
+                      or Config.user_agent)
+        self._own_opener = opener is None
+        if opener is None:
+            opener = urlreq.build_opener()
+            opener.addheaders = []
+            add_headers(opener, {'User-agent': user_agent})
+        self.opener = opener
+        self.stats = {} # section => SectionStats
+        self.listing = DirListing()
+        self.replay = replay
+        self.replay_time = replay_time
+
+    def close(self):
+        """Release the resources held by the retriever."""
+        if self._own_opener:
+            self.opener.close()
+
+    @property
+    def delay(self):
+        """Seconds to wait between polls, from the config file."""
+        return int(self.cfg.defaults().get(Config.Fields.delay, Config.delay)
+                   or Config.delay)
+
+    def get_entries(self, url, timeout=None):
+        """Returns the entries (FeedParserDict) from the given url.
+        If *timeout* is None, use the retriever's one.
+        """
+        if self.replay:
+            cached = (self.feed_cache
+                      and self.feed_cache.load(url, self.replay_time))
+            if not cached:
+                logging.info('no cached feed for {}'.format(url))
+                return []
+            body, headers = cached
+            return feedparser.parse(body, response_headers=headers).entries
+        return get_entries(url, self.opener,
+                           self.timeout if timeout is None else timeout,
+                           self.feed_cache)
+
+    def poll(self, sections=(), budget=None):
+        """Retrieve feeds from *sections* (all if empty) and
+        returns a list of (section, entry, path) for the saved entries.
+        See poll_iter() for *budget*.
+        """
+        return list(self.poll_iter(sections, budget))
+
+    def cycle(self, sections=(), budget=None):
+        """A retrieving cycle: save the entries from the recovery file,
+        then poll *sections* (see poll()). If *budget* (seconds) is
+        given, the whole cycle must fit in it.
+        """
+        # the savepaths are listed once for the whole cycle
+        self.listing.clear()
+        if not budget:
+            self._recover()
+            return list(self._poll_iter(sections))
+        deadline = time.time() + budget
+        self._recover(deadline)
+        return list(self._poll_iter(
+                sections, max(deadline - time.time(), 0.001)))
+
+    def poll_iter(self, sections=(), budget=None):
+        """Retrieve feeds from *sections* (all if empty), yielding a
+        (section, entry, path) tuple as soon as an entry has been saved.
+        Failed entries are written in the recovery file.
+        The config file is read again at each call.
+        If *budget* (seconds) is given, sections are processed by
+        priority (see priority()) and the work which doesn't fit in
+        the budget is deferred: sections to the next poll, entries of
+        an already started section to the recovery file.
+        """
+        self.listing.clear()
+        for saved in self._poll_iter(sections, budget):
+            yield saved
+
+    def _poll_iter(self, sections=(), budget=None):
+        """poll_iter() without listing the savepaths again."""
+        self.reload()
+        cfg = self.cfg
+        if not sections:
+            sections = list(cfg.sections())
+        sections = set(cfg.sections()).intersection(sections)
+        if not budget:
+            for section in sections:
+                for saved in self._poll_section(section):
+                    yield saved
+            return
+        now = time.time()
+        deadline = now + budget
+        first = True
+        for section in sorted(sections, reverse=True,
+                              key=lambda s: self.priority(s, now)):
+            remaining = deadline - time.time()
+            stats = self.section_stats(section)
+            # the first section always runs, to not starve the slow ones
+            if remaining <= 0 or (
+                not first and stats.polled and stats.duration > remaining):
+                logging.info('deferring {} to the next poll'.format(section))
+                continue
+            first = False
+            for saved in self._poll_section(section, deadline):
+                yield saved
+
+    def _poll_section(self, section, deadline=None):
+        """Retrieve the feed of *section*, yielding the saved entries
+        as (section, entry, path). Entries left when the *deadline*
+        (if any) expires are written in the recovery file.
+        """
+        cfg = self.cfg
+        start = time.time()
+        url = cfg.get(section, Config.Fields.feed_url)
+        info = self.get_entries(url, self._timeout(deadline))
+        if not info:
+            logging.info('no entries from {}'.format(url))
+            self._record_poll(section, start, [])
+            return
+        if self.replay:
+            last_update = 0
+        else:
+            last_update = float(cfg.get(section, Config.Fields.last_update))
+        entries = list(retrieve_news(info, time_to_struct(last_update)))
+        del info # release the feed as soon as possible
+        if not entries:
+            self._record_poll(section, start, entries)
+            return
+        logging.info('start retrive pages from {}'.format(section))
+        save_path = cfg.get(section, Config.Fields.save_path)
+        format_title = TitleFormatter(self.format_func, cfg.items(section))
+        compress = Config.compress
+        if cfg.has_option(section, Config.Fields.compress):
+            compress = cfg.get(section, Config.Fields.compress).lower()
+        if compress not in COMPRESSIONS:
+            logging.error("Unknown compression {} in {}, using none".format(
+                    compress, section))
+            compress = 'none'
+        for e in entries:
+            dest = (os.path.join(save_path, format_title(e))
+                    + COMPRESSIONS[compress][0])
+            if deadline is not None and time.time() >= deadline:
+                logging.info('out of time, deferring {}'.format(e.link))
+                write_recovery_entry(self.recfile, e.link, dest, compress)
+                continue
+            logging.info('saving {title} [{type}]'.format(
+                    title=e.title,
+                    type=e.link_type))
+            try:
+                self.save(e.link, dest, self._timeout(deadline), compress)
+            except SaveError as err:
+                write_recovery_entry(self.recfile, e.link, dest, compress)
+            else:
+                yield section, e, dest
+        self._record_poll(section, start, entries)
+
+    def _record_poll(self, section, start, entries):
+        """Update the stats of *section*, polled from the *start* time
+        and with the new *entries*, and write them in the config file
+        (with the last update time, if there are entries).
+        """
+        stats = self.section_stats(section)
+        stats.update(time.time() - start, len(entries))
+        if self.replay or self.config_file is None:
+            return
+        pairs = stats.items()
+        if entries:
+            pairs.append((Config.Fields.last_update,
+                          str(struct_to_time(max(e.date for e in entries)))))
+        write_config(self.config_file, section, pairs)
+
+    def priority(self, section, now=None):
+        """Returns the priority of *section*, which grows with its
+        configured weight (the priority field), the time elapsed since
+        its last poll and the number of new entries it usually has.
+        """
+        if now is None:
+            now = time.time()
+        if self.cfg.has_option(section, Config.Fields.priority):
+            weight = float(self.cfg.get(section, Config.Fields.priority))
+        else:
+            weight = Config.priority
+        stats = self.section_stats(section)
+        staleness = (now - stats.last_poll) / max(self.delay, 1)
+        return weight * (1 + stats.news) * (1 + staleness)
+
+    def section_stats(self, section):
+        """Returns the SectionStats of *section*, read from the
+        config file the first time.
+        """
+        try:
+            return self.stats[section]
+        except KeyError:
+            stats = self.stats[section] = SectionStats.from_config(
+                self.cfg, section)
+            return stats
+
+    def poll_urls(self, urls, dest):
+        """Save all the entries from the feeds at *urls* in the
+        directory *dest*, yielding (url, entry, path) for the saved ones.
+        Failed entries are not written in the recovery file.
+        """
+        self.listing.clear()
+        for url in urls:
+            logging.info('start retrive pages from {}'.format(url))
+            entries = [Entry.from_feed(e) for e in self.get_entries(url)]
+            if not entries:
+                logging.info('no entries from {}'.format(url))
+            for e in entries:
+                logging.info('saving {title} [{type}]'.format(
+                        title=e.title,
+                        type=e.link_type))
+                path = os.path.join(dest, e.title)
+                try:
+                    self.save(e.link, path)
+                except SaveError as err:
+                    pass
+                else:
+                    yield url, e, path
+
+    def recover(self, deadline=None):
+        """Save uris stored in the recovery file.
+        The file is read lazily, skipping duplicated entries, and the
+        failed ones are written to a new file which replaces the old
+        one only at the end, so nothing is lost if interrupted.
+        Entries left when the *deadline* (if any) expires are kept
+        in the recovery file without trying them.
+        """
+        self.listing.clear()
+        self._recover(deadline)
+
+    def _recover(self, deadline=None):
+        """recover() without listing the savepaths again."""
+        recfile = self.recfile
+        if self.replay:
+            logging.info("Replaying, skip the recovery file...")
+            return
+        if not os.path.exists(recfile):
+            logging.info("No recovery file found, skip...")
+            return
+        logging.info("Start retrieve urls to be recovered...")
+        try:
+            writer = RecoveryWriter(recfile)
+        except IOError as e:
+            logging.info(
+                "Error while writing recovery file {}, skip...".format(e))
+            return
+        try:
+            for url, path, compress in iter_recovery(recfile):
+                if deadline is not None and time.time() >= deadline:
+                    writer.write(url, path, compress)
+                    continue
+                try:
+                    self.save(url, path, self._timeout(deadline), compress)
+                except SaveError as err:
+                    writer.write(url, path, compress)
+                except (IOError, OSError) as err:
+                    # e.g. a missing destination directory
+                    logging.error('in recover() -- {}: {}'.format(err, path))
+                    writer.write(url, path, compress)
+        except IOError as e:
+            writer.abort()
+            logging.info(
+                "Error while replaying recovery file {}, skip...".format(e))
+            return
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def reload(self):
+        """Read the config file again."""
+        if self.config_file is None:
+            self.cfg = configparser.ConfigParser()
+        else:
+            self.cfg = read_config(self.config_file)
+        defaults = self.cfg.defaults()
+        self.breaker.threshold = int(
+            defaults.get(Config.Fields.breaker_threshold)
+            or Config.breaker_threshold)
+        self.breaker.cooldown = int(
+            defaults.get(Config.Fields.breaker_cooldown)
+            or Config.breaker_cooldown)
+        cache_dir = os.path.expanduser(
+            defaults.get(Config.Fields.feed_cache) or '')
+        if not cache_dir:
+            self.feed_cache = None
+        else:
+            if self.feed_cache is None or self.feed_cache.path != cache_dir:
+                self.feed_cache = FeedCache(cache_dir)
+            self.feed_cache.max_size = int(
+                defaults.get(Config.Fields.feed_cache_size)
+                or Config.feed_cache_size)
+            self.feed_cache.compress = (
+                self.cfg.has_option(configparser.DEFAULTSECT,
+                                    Config.Fields.feed_cache_compress)
+                and self.cfg.getboolean(configparser.DEFAULTSECT,
+                                        Config.Fields.feed_cache_compress))
+
+    def save(self, url, dest, timeout=None, compress='none'):
+        """Save the content of *url* in *dest* (see save()).
+        If *timeout* is None, use the retriever's one.
+        Raise SaveError at once if the url's host is unreachable
+        (see HostBreaker).
+        """
+        if self.replay:
+            logging.info('* replay, not saving {}: {}'.format(url, dest))
+            return
+        host = urlparse(url).netloc
+        # already saved files don't need the host
+        if (saved_path(dest, self.listing.exists, compress) is None
+            and not self.breaker.allow(host)):
+            logging.info('* skipping {} (host unreachable)'.format(url))
+            raise SaveError('host {} unreachable'.format(host))
+        try:
+            saved = save(url, dest,
+                         self.timeout if timeout is None else timeout,
+                         self.opener, self.listing.exists, compress)
+        except SaveError as err:
+            err = err.args[0]
+            if isinstance(err, urlreq.HTTPError):
+                self.breaker.success(host) # the host answered
+            elif isinstance(err, (urlreq.URLError, socket.timeout)):
+                self.breaker.failure(host)
+            # other errors (e.g. writing dest) aren't the host's fault
+            raise
+        if saved:
+            self.breaker.success(host)
+            self.listing.add(dest)
+
+    def _timeout(self, deadline=None):
+        """Returns the timeout to use for a connection, which must not
+        last beyond *deadline*, if any.
+        """
+        if deadline is None:
+            return self.timeout
+        remaining = max(deadline - time.time(), 0.1)
+        if self.timeout is None:
+            return remaining
+        return min(self.timeout, remaining)
 
 
 ########
 # MAIN #
 ########
 def main(config_file, recfile, always_run,
-         format_func, sections, timeout=None):
-    cfg = read_config(config_file)
-    recfile = (recfile
-               or cfg.defaults().get(
-            Config.Fields.recovery_file, Config.recovery_file)
-               or Config.recovery_file)
+         format_func, sections, timeout=None, budget=None):
+    """Run the retrieving cycles with a new FeedRetriever using
+    the globally installed opener (see main_loop()).
+    """
+    retriever = FeedRetriever(config_file, recfile, format_func,
+                              timeout, opener=InstalledOpener())
+    with closing(retriever):
+        main_loop(retriever, always_run, sections, budget)
+
+
+def main_loop(retriever, always_run, sections, budget=None):
+    """Run a retrieving cycle of *retriever* (see FeedRetriever.cycle())
+    on *sections*, within the *budget*, if any. If *always_run*, run
+    them forever, sleeping the config file's delay between them.
+    """
     if always_run:
         while True:
-            cfg = read_config(config_file)
             logging.info('{} start retrieving feeds'.format(time.ctime()))
-            run(config_file, recfile, format_func, sections, timeout)
-            delay = int(cfg.defaults().get(Config.Fields.delay, Config.delay)
-                        or Config.delay)
+            retriever.cycle(sections, budget)
+            delay = retriever.delay
             logging.info('{} sleeping for {} sec'.format(time.ctime(), delay))
             time.sleep(delay)
     else:
-        run(config_file, recfile, format_func, sections, timeout)
+        retriever.cycle(sections, budget)
 
 
 if __name__ == '__main__':
     parser = get_arg_parser()
     args = parser.parse_args()
 
-    cfg = read_config(args.cfg)
-    user_agent = args.user_agent or (
-        cfg.defaults().get(Config.Fields.user_agent, Config.user_agent)
-        or Config.user_agent)
-    set_headers({'User-agent':user_agent})
-    timeout = (args.timeout
-               or int(cfg.defaults().get(Config.Fields.timeout, 0) or 0)
-               or Config.timeout)
-
     set_logger(args.log, args.loglevel)
     logging.info('{} start at {}'.format(sys.argv[0], time.ctime()))
 
     if args.list_sections:
-        print("\n".join(cfg.sections()))
+        print("\n".join(read_config(args.cfg).sections()))
         sys.exit(0)
 
-    recfile = (args.recovery_file
-               or cfg.defaults().get(
-            Config.Fields.recovery_file, Config.recovery_file)
-               or Config.recovery_file)
-    save_from_recovery(recfile, timeout)
-
-    if args.from_urls:
-        feeds_from_urls(args.from_urls, args.dest or os.getcwd(), timeout)
-        sys.exit(0)
-    if args.also_from_urls:
-        feeds_from_urls(args.also_from_urls, args.dest or os.getcwd(), timeout)
     if args.ffunc:
         module, func = args.ffunc.split('.')
         try:
@@ -540,5 +1478,23 @@ if __name__ == '__main__':
             parser.error("Can't load plugin {}: {}".format(args.ffunc, err))
     else:
         format_title = _format_title
-    main(args.cfg, args.recovery_file, args.nonstop,
-         format_title, args.sections, timeout)
+
+    retriever = FeedRetriever(args.cfg, args.recovery_file, format_title,
+                              args.timeout or None, args.user_agent,
+                              args.replay is not None,
+                              replay_time=args.replay or None)
+    if retriever.replay and retriever.feed_cache is None:
+        parser.error("--replay needs the feed_cache config value")
+    with closing(retriever):
+        if args.from_urls:
+            retriever.recover()
+            for _ in retriever.poll_urls(args.from_urls,
+                                         args.dest or os.getcwd()):
+                pass
+            sys.exit(0)
+        if args.also_from_urls:
+            for _ in retriever.poll_urls(args.also_from_urls,
+                                         args.dest or os.getcwd()):
+                pass
+        main_loop(retriever, args.nonstop, args.sections,
+                  args.cycle_budget or None)
@@ -7,6 +7,8 @@ import argparse
 from collections import defaultdict
 from contextlib import closing
 import datetime
+import errno
+import gzip
 import io
 import logging
 import os
@@ -35,6 +37,13 @@ class NoLogHandler(Handler):
     def log_message(self, *a, **k):
         pass
 
+class AgentHandler(NoLogHandler):
+    """Records the user agents of the requests."""
+    agents = []
+    def do_GET(self):
+        self.agents.append(self.headers.get('User-agent'))
+        return NoLogHandler.do_GET(self)
+
 FAKE_CONFIGS = (
     ("""[DEFAULT]
 foo = foo
@@ -116,6 +125,37 @@ FAKE_REC_FAIL = ( # triplets of (fake_rec, entries, errors)
     (b'1\n2\n\n3\n4\n5\n', 2, 1))
 
 
+FAKE_FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+<channel>
+<title>fake</title>
+<link>{base}</link>
+<description>fake feed</description>
+{items}
+</channel>
+</rss>
+"""
+
+FAKE_ITEM = """<item>
+<title>{title}</title>
+<link>{base}/{page}</link>
+<guid>{base}/{page}</guid>
+<pubDate>{date}</pubDate>
+<description>{title} description</description>
+</item>
+"""
+
+
+def fake_feed(base, pages, dates):
+    """Returns the text of a rss feed with an item for each page."""
+    items = ''.join(FAKE_ITEM.format(
+            title='title {}'.format(page), base=base, page=page,
+            date=time.strftime('%a, %d %b %Y %H:%M:%S +0000',
+                               time.gmtime(date)))
+                    for page, date in zip(pages, dates))
+    return FAKE_FEED.format(base=base, items=items)
+
+
 class ServerControl:
     def __init__(self, server_cls, host, port, handler):
         self.server = server_cls((host, port), handler)
@@ -175,6 +215,93 @@ class TestNumbersAndDate(unittest.TestCase):
             self.assertEqual(struct[:-1], ret[:-1])
 
 
+class TestEntry(unittest.TestCase):
+    def testEntries(self):
+        now = int(time.time())
+        pages = ['p{}'.format(i) for i in range(10)]
+        dates = [now - i * 100 for i in range(10)]
+        feed = feedretrieve.feedparser.parse(
+            fake_feed('http://localhost', pages, dates))
+        last = now - 450
+        entries = list(feedretrieve.retrieve_news(
+                feed.entries, feedretrieve.time_to_struct(last)))
+        self.assertEqual(len(entries), 5)
+        for e, page, date in zip(entries, pages, dates):
+            self.assertEqual(e.link, 'http://localhost/{}'.format(page))
+            self.assertEqual(e['title'], e.title)
+            self.assertEqual(e.id, e.link)
+            self.assertEqual(feedretrieve.struct_to_time(e.date), date)
+            self.assertEqual(e.updated_parsed, e.date)
+            self.assertEqual(e['__date'], e.date)
+            self.assertEqual(dict(e)['link'], e.link)
+            self.assertRaises(KeyError, lambda: e['summary'])
+            self.assertRaises(AttributeError, lambda: e.summary)
+            self.assertFalse(hasattr(e, '__dict__'))
+
+    def testNoDate(self):
+        logging.disable(logging.INFO)
+        try:
+            feed = feedretrieve.feedparser.parse(FAKE_FEED.format(
+                    base='', items='<item><title>x</title></item>'))
+            self.assertFalse(list(feedretrieve.retrieve_news(feed.entries)))
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+class TestFormatTitle(unittest.TestCase):
+    def entry(self, title, date=(2013, 4, 11)):
+        return feedretrieve.Entry(
+            title, 'http://localhost/x', 'text/html', title,
+            datetime.datetime(*date).timetuple())
+
+    def testSubs(self):
+        translate = feedretrieve.compile_subs({'a': 'b', 'b': 'c'})
+        # single pass: the replaced string must not be substituted again
+        self.assertEqual(translate('aabbx'), 'bbccx')
+        self.assertEqual(feedretrieve.compile_subs({})('abc'), 'abc')
+        self.assertEqual(feedretrieve._translate_title(
+                'a title, with (parens): yes'),
+                         'a-title--with-_parens_--yes')
+
+    def testDefaultFormat(self):
+        items = {'prefix': 'pre_', 'suffix': '_suf', 'ext': 'html'}
+        self.assertEqual(
+            feedretrieve._format_title(self.entry('a b'), items),
+            'pre_a-b_suf_20130411.html')
+        items['title_template'] = '{year}/{title}{ext}'
+        self.assertEqual(
+            feedretrieve._format_title(self.entry('a b'), items),
+            '2013/a-bhtml')
+
+    def testBadTemplate(self):
+        items = {'prefix': '', 'suffix': '', 'ext': 'html'}
+        logging.disable(logging.ERROR)
+        try:
+            for template in ('{titel}.{ext}', '{title}{', '{}', '{title:d}',
+                             '{year.x}'):
+                items['title_template'] = template
+                self.assertEqual(
+                    feedretrieve._format_title(self.entry('a'), items),
+                    'a_20130411.html')
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def testFormatter(self):
+        calls = []
+        def plugin(entry, items):
+            calls.append(entry.id)
+            return items['prefix'] + entry['title']
+        formatter = feedretrieve.TitleFormatter(plugin, [('prefix', 'x')])
+        self.assertEqual(formatter(self.entry('a')), 'xa')
+        self.assertEqual(formatter(self.entry('b')), 'xb')
+        self.assertEqual(calls, ['a', 'b'])
+        formatter = feedretrieve.TitleFormatter(
+            feedretrieve._format_title,
+            [('prefix', ''), ('suffix', ''), ('ext', 'txt')])
+        self.assertEqual(formatter(self.entry('a', (2001, 2, 3))),
+                         'a_20010203.txt')
+
+
 class TestHeaders(unittest.TestCase):
 
     def random_headers(self):
@@ -218,6 +345,515 @@ class TestHeaders(unittest.TestCase):
                 server.stop()
 
 
+class TestRetriever(unittest.TestCase):
+    """Retrieve feeds served from a local directory."""
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.savedir = os.path.join(self.tmpdir, 'saved')
+        self.servedir = os.path.join(self.tmpdir, 'served')
+        os.mkdir(self.savedir)
+        os.mkdir(self.servedir)
+        os.chdir(self.servedir)
+        self.server = ServerControl(Server, '127.0.0.1', 0, AgentHandler)
+        AgentHandler.agents = []
+        self.base = 'http://127.0.0.1:{}'.format(
+            self.server.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.start)
+        self.thread.start()
+        self.cfg_path = os.path.join(self.tmpdir, 'feeds.cfg')
+        self.rec_path = os.path.join(self.tmpdir, 'failed')
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.server.stop()
+        self.thread.join()
+        self.server.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def write_feed(self, name, pages, dates, missing=()):
+        with open(os.path.join(self.servedir, name), 'w') as out:
+            out.write(fake_feed(self.base, pages, dates))
+        for page in pages:
+            if page not in missing:
+                with open(os.path.join(self.servedir, page), 'w') as out:
+                    out.write('content of {}'.format(page))
+
+    def write_config(self, sections, **defaults):
+        cfg = configparser.ConfigParser()
+        for section, feed in sections:
+            cfg.add_section(section)
+            cfg.set(section, 'feed_url', '{}/{}'.format(self.base, feed))
+            cfg.set(section, 'savepath', self.savedir)
+            cfg.set(section, 'last_update_time', '0')
+            cfg.set(section, 'prefix', '')
+            cfg.set(section, 'suffix', '')
+            cfg.set(section, 'ext', 'html')
+        for k, v in defaults.items():
+            cfg.set('DEFAULT', k, str(v))
+            for section, _ in sections:
+                cfg.remove_option(section, k)
+        with open(self.cfg_path, 'w') as out:
+            cfg.write(out)
+
+    def testPoll(self):
+        now = int(time.time())
+        self.write_feed('feed.xml', ['p1', 'p2', 'p3'],
+                        [now - 300, now - 200, now - 100], missing=['p3'])
+        self.write_config([('fake', 'feed.xml')])
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            saved = retriever.poll()
+            self.assertEqual(len(saved), 2)
+            for section, entry, path in saved:
+                self.assertEqual(section, 'fake')
+                with open(path) as f:
+                    self.assertEqual(f.read(), 'content of {}'.format(
+                            entry.link.rsplit('/', 1)[-1]))
+            self.assertEqual(
+                feedretrieve.read_recovery(self.rec_path)[0][0][0],
+                '{}/p3'.format(self.base))
+            cfg = feedretrieve.read_config(self.cfg_path)
+            self.assertEqual(int(cfg.get('fake', 'last_update_time')),
+                             now - 100)
+            # nothing new on the second poll
+            self.assertFalse(list(retriever.poll_iter()))
+
+    def testMain(self):
+        now = int(time.time())
+        self.write_feed('feed.xml', ['p1', 'p2'], [now - 200, now - 100])
+        self.write_config([('fake', 'feed.xml')])
+        feedretrieve.main(self.cfg_path, self.rec_path, False, None, [],
+                          timeout=5)
+        self.assertEqual(len(os.listdir(self.savedir)), 2)
+
+    def testCycle(self):
+        now = int(time.time())
+        self.write_feed('feed.xml', ['p1', 'p2'], [now - 200, now - 100],
+                        missing=['p2'])
+        self.write_config([('fake', 'feed.xml')])
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            self.assertEqual(len(retriever.cycle()), 1)
+            self.write_feed('feed.xml', ['p2', 'p3'], [now - 100, now])
+            clears = []
+            clear = retriever.listing.clear
+            def counting_clear():
+                clears.append(1)
+                clear()
+            retriever.listing.clear = counting_clear
+            # p2 from the recovery file, p3 from the feed
+            self.assertEqual(len(retriever.cycle()), 1)
+            self.assertEqual(len(os.listdir(self.savedir)), 3)
+            self.assertFalse(os.path.exists(self.rec_path))
+            # the savepaths are listed once per cycle
+            self.assertEqual(len(clears), 1)
+
+    def testBudget(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1', 'a2'], [now - 20, now - 10])
+        self.write_feed('b.xml', ['b1', 'b2'], [now - 20, now - 10])
+        self.write_config([('a', 'a.xml'), ('b', 'b.xml')])
+        cfg = feedretrieve.read_config(self.cfg_path)
+        cfg.set('a', 'priority', '3')
+        with open(self.cfg_path, 'w') as out:
+            cfg.write(out)
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            self.assertTrue(retriever.priority('a') > retriever.priority('b'))
+            # b is too slow to fit in the budget
+            retriever.stats['b'] = feedretrieve.SectionStats()
+            retriever.stats['b'].update(1000, 1)
+            retriever.stats['b'].last_poll = 1
+            saved = retriever.poll(budget=60)
+            self.assertEqual(set(s for s, _, _ in saved), set(['a']))
+            # now b is the most stale, so it runs first
+            saved = retriever.poll(budget=60)
+            self.assertEqual(set(s for s, _, _ in saved), set(['b']))
+            self.assertFalse(os.path.exists(self.rec_path))
+
+    def testPersistedStats(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1'], [now - 10])
+        self.write_feed('b.xml', ['b1'], [now - 10])
+        self.write_config([('a', 'a.xml'), ('b', 'b.xml')])
+        cfg = feedretrieve.read_config(self.cfg_path)
+        # b hasn't been polled for a long time
+        cfg.set('a', 'last_update_time', str(now - 60))
+        cfg.set('b', 'last_update_time', str(now - 86400))
+        with open(self.cfg_path, 'w') as out:
+            cfg.write(out)
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            self.assertTrue(retriever.priority('b') > retriever.priority('a'))
+            retriever.poll()
+        cfg = feedretrieve.read_config(self.cfg_path)
+        for section in ('a', 'b'):
+            self.assertEqual(cfg.get(section, 'poll_news'), '1.0')
+            self.assertTrue(
+                int(cfg.get(section, 'last_poll_time')) >= now)
+        # a new run (e.g. from cron) starts from the saved stats
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            stats = retriever.section_stats('a')
+            self.assertTrue(stats.polled)
+            self.assertEqual(stats.news, 1.0)
+
+    def testBudgetExpired(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1', 'a2'], [now - 20, now - 10])
+        self.write_config([('a', 'a.xml')])
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            gen = retriever.poll_iter(budget=60)
+            next(gen)
+            time_ = feedretrieve.time.time
+            feedretrieve.time.time = lambda: time_() + 120
+            try:
+                self.assertFalse(list(gen))
+            finally:
+                feedretrieve.time.time = time_
+            data, errors = feedretrieve.read_recovery(self.rec_path)
+            self.assertEqual(len(data), 1)
+            # the next cycle retries it, but not beyond the deadline
+            retriever.recover(time.time() - 1)
+            self.assertEqual(feedretrieve.read_recovery(self.rec_path)[0],
+                             data)
+            self.assertFalse(retriever.cycle(budget=60))
+            self.assertFalse(os.path.exists(self.rec_path))
+            self.assertTrue(os.path.exists(data[0][1]))
+
+    def testReplay(self):
+        now = int(time.time())
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.write_feed('a.xml', ['a1', 'a2'], [now - 20, now - 10])
+        self.write_config([('a', 'a.xml')], feed_cache=cache_dir,
+                          feed_cache_compress='yes')
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            saved = retriever.poll()
+        self.assertEqual(len(saved), 2)
+        for _, _, path in saved:
+            os.remove(path)
+        with open(self.cfg_path) as f:
+            config = f.read()
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5,
+                replay=True)) as retriever:
+            opener, retriever.opener = retriever.opener, None # no network
+            replayed = retriever.poll()
+            retriever.opener = opener
+        self.assertEqual([(s, p) for s, _, p in saved],
+                         [(s, p) for s, _, p in replayed])
+        for _, _, path in replayed:
+            self.assertFalse(os.path.exists(path))
+        with open(self.cfg_path) as f:
+            self.assertEqual(f.read(), config)
+        # a later poll doesn't change the replay of a given time
+        when = int(time.time())
+        time.sleep(1)
+        self.write_feed('a.xml', ['a3'], [now])
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            self.assertEqual(len(retriever.poll()), 1)
+        for replay_time, n in ((when, 2), (None, 1)):
+            with closing(feedretrieve.FeedRetriever(
+                    self.cfg_path, self.rec_path, timeout=5, replay=True,
+                    replay_time=replay_time)) as retriever:
+                self.assertEqual(len(retriever.poll()), n)
+
+    def testCompress(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1', 'a2'], [now - 20, now - 10])
+        self.write_config([('a', 'a.xml')], compress='gzip')
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            saved = retriever.poll()
+            self.assertEqual(len(saved), 2)
+            for _, entry, path in saved:
+                self.assertTrue(path.endswith('.html.gz'))
+                with gzip.open(path, 'rb') as f:
+                    self.assertEqual(f.read().decode('utf-8'),
+                                     'content of {}'.format(
+                            entry.link.rsplit('/', 1)[-1]))
+                # the uncompressed and lzma names are already saved too
+                for dest, compress in ((path[:-3], 'none'),
+                                       (path[:-3] + '.xz', 'lzma')):
+                    if compress not in feedretrieve.COMPRESSIONS:
+                        continue # no lzma on python 2
+                    self.assertFalse(feedretrieve.save(
+                            entry.link, dest, compress=compress))
+                    self.assertFalse(os.path.exists(dest))
+
+    def testBadFeeds(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1'], [now - 10])
+        with closing(feedretrieve.FeedRetriever(
+                self.cfg_path, self.rec_path, timeout=5)) as retriever:
+            entries = retriever.get_entries(
+                os.path.join(self.servedir, 'a.xml'))
+            self.assertEqual(len(entries), 1)
+            for url in ('http://127.0.0.1:99999/', 'http://127.0.0.1:1/',
+                        '{}/missing.xml'.format(self.base)):
+                self.assertEqual(retriever.get_entries(url), [])
+
+    def testInstalledOpener(self):
+        now = int(time.time())
+        self.write_feed('a.xml', ['a1'], [now - 10])
+        feedretrieve.write_recovery_entry(
+            self.rec_path, '{}/a1'.format(self.base),
+            os.path.join(self.savedir, 'a1'))
+        opener = feedretrieve.urlreq._opener
+        try:
+            feedretrieve.set_headers({'User-agent': 'installed'})
+            feedretrieve.save_from_recovery(self.rec_path, 5)
+            feedretrieve.feeds_from_urls(
+                ['{}/a.xml'.format(self.base)], self.tmpdir, 5)
+        finally:
+            feedretrieve.urlreq.install_opener(opener)
+        self.assertTrue(os.path.exists(os.path.join(self.savedir, 'a1')))
+        self.assertEqual(AgentHandler.agents, ['installed'] * 3)
+        with closing(feedretrieve.FeedRetriever(
+                None, self.rec_path)) as retriever:
+            self.assertFalse(retriever.cfg.defaults())
+            self.assertFalse(retriever.cfg.sections())
+
+    def testRecoverCompression(self):
+        now = int(time.time())
+        for compress, ext in (('none', 'gz'), ('gzip', 'html')):
+            feed = '{}.xml'.format(compress)
+            self.write_feed(feed, [compress], [now - 10], missing=[compress])
+            self.write_config([(compress, feed)], compress=compress, ext=ext)
+            with closing(feedretrieve.FeedRetriever(
+                    self.cfg_path, self.rec_path, timeout=5)) as retriever:
+                self.assertFalse(retriever.poll())
+                with open(os.path.join(self.servedir, compress), 'w') as out:
+                    out.write('content')
+                retriever.recover()
+            self.assertFalse(os.path.exists(self.rec_path))
+            path = [os.path.join(self.savedir, name)
+                    for name in os.listdir(self.savedir)
+                    if name.startswith('title-{}'.format(compress))][0]
+            self.assertTrue(path.endswith('.gz'))
+            with (gzip.open if compress == 'gzip' else open)(path, 'rb') as f:
+                self.assertEqual(f.read(), b'content')
+
+
+class TestBreaker(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def testStates(self):
+        breaker = feedretrieve.HostBreaker(threshold=3, cooldown=60)
+        for _ in range(2):
+            breaker.failure('a')
+            self.assertTrue(breaker.allow('a'))
+        breaker.success('a')
+        for _ in range(2):
+            breaker.failure('a')
+        self.assertEqual(breaker.state('a'), 'closed')
+        breaker.failure('a')
+        self.assertEqual(breaker.state('a'), 'open')
+        self.assertFalse(breaker.allow('a'))
+        self.assertTrue(breaker.allow('b'))
+        breaker._opened['a'] -= 60
+        self.assertEqual(breaker.state('a'), 'half-open')
+        self.assertTrue(breaker.allow('a'))
+        self.assertFalse(breaker.allow('a'))
+        breaker.failure('a')
+        self.assertEqual(breaker.state('a'), 'open')
+        breaker._opened['a'] -= 60
+        self.assertTrue(breaker.allow('a'))
+        breaker.success('a')
+        self.assertEqual(breaker.state('a'), 'closed')
+
+    def _testFailFast(self, retriever, tmpdir):
+        # nothing listen on port 1
+        url = 'http://127.0.0.1:1/page'
+        for i in range(retriever.breaker.threshold):
+            self.assertRaises(feedretrieve.SaveError, retriever.save,
+                              url, os.path.join(tmpdir, str(i)))
+        self.assertEqual(retriever.breaker.state('127.0.0.1:1'), 'open')
+        class NoOpener:
+            def open(self, *a, **k):
+                raise AssertionError("connection tried")
+        opener, retriever.opener = retriever.opener, NoOpener()
+        try:
+            self.assertRaises(feedretrieve.SaveError, retriever.save,
+                              url, os.path.join(tmpdir, 'x'))
+        finally:
+            retriever.opener = opener
+
+    def testFailFast(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with closing(feedretrieve.FeedRetriever(
+                    os.path.join(tmpdir, 'none.cfg'),
+                    os.path.join(tmpdir, 'failed'), timeout=5)) as retriever:
+                self._testFailFast(retriever, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def testLocalErrors(self):
+        tmpdir = tempfile.mkdtemp()
+        class FullDisk:
+            def open(self, *a, **k):
+                raise IOError(errno.ENOSPC, 'No space left on device')
+        try:
+            with closing(feedretrieve.FeedRetriever(
+                    os.path.join(tmpdir, 'none.cfg'),
+                    os.path.join(tmpdir, 'failed'), timeout=5)) as retriever:
+                opener, retriever.opener = retriever.opener, FullDisk()
+                try:
+                    for i in range(retriever.breaker.threshold):
+                        self.assertRaises(
+                            feedretrieve.SaveError, retriever.save,
+                            'http://a/page', os.path.join(tmpdir, str(i)))
+                finally:
+                    retriever.opener = opener
+                self.assertEqual(retriever.breaker.state('a'), 'closed')
+                self.assertFalse(retriever.breaker._failures.get('a'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestFeedCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testStoreLoad(self):
+        for compress in (False, True):
+            cache = feedretrieve.FeedCache(
+                os.path.join(self.tmpdir, str(compress)), compress=compress)
+            self.assertEqual(cache.load('http://a'), None)
+            cache.store('http://a', b'old', {'x': 'old'}, when=10)
+            cache.store('http://a', b'new', {'x': 'new'}, when=20)
+            cache.store('http://b', b'b', {}, when=30)
+            self.assertEqual(cache.load('http://a'), (b'new', {'x': 'new'}))
+            self.assertEqual(cache.load('http://a', when=15),
+                             (b'old', {'x': 'old'}))
+            self.assertEqual(cache.load('http://a', when=5), None)
+            self.assertEqual(cache.load('http://b'), (b'b', {}))
+            self.assertEqual(len(os.listdir(cache.path)), 3)
+
+    def testReload(self):
+        cfg_path = os.path.join(self.tmpdir, 'feeds.cfg')
+        def write_config(**defaults):
+            cfg = configparser.ConfigParser()
+            for k, v in defaults.items():
+                cfg.set('DEFAULT', k, str(v))
+            with open(cfg_path, 'w') as out:
+                cfg.write(out)
+        write_config()
+        with closing(feedretrieve.FeedRetriever(cfg_path)) as retriever:
+            self.assertEqual(retriever.feed_cache, None)
+            cache_dir = os.path.join(self.tmpdir, 'cache')
+            write_config(feed_cache=cache_dir, feed_cache_size=10)
+            retriever.reload()
+            cache = retriever.feed_cache
+            self.assertEqual((cache.path, cache.max_size, cache.compress),
+                             (cache_dir, 10, False))
+            write_config(feed_cache=cache_dir, feed_cache_compress='yes')
+            retriever.reload()
+            self.assertTrue(retriever.feed_cache is cache)
+            self.assertEqual((cache.max_size, cache.compress),
+                             (feedretrieve.Config.feed_cache_size, True))
+            write_config()
+            retriever.reload()
+            self.assertEqual(retriever.feed_cache, None)
+
+    def testBadFiles(self):
+        logging.disable(logging.WARNING)
+        try:
+            cache = feedretrieve.FeedCache(self.tmpdir, max_size=10000)
+            cache.store('http://a', b'good', {}, when=10)
+            key = cache._key('http://a')
+            # leftovers of interrupted stores, and a broken file
+            for name, data in (('{}_20.feed.tmp', b'{"x'),
+                               ('{}_30.feed.gz.tmp', b'x' * 20000),
+                               ('{}_15.feed', b'not json\n')):
+                with open(os.path.join(self.tmpdir, name.format(key)),
+                          'wb') as out:
+                    out.write(data)
+            self.assertEqual(cache.load('http://a'), (b'good', {}))
+            cache.evict()
+            self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                             ['{}_10.feed'.format(key),
+                              '{}_15.feed'.format(key)])
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def testEvict(self):
+        cache = feedretrieve.FeedCache(self.tmpdir, max_size=10000)
+        body = b'x' * 3000
+        for i in range(3):
+            cache.store('http://{}'.format(i), body, {}, when=i)
+        # make http://0 the most recently used
+        for name in os.listdir(self.tmpdir):
+            os.utime(os.path.join(self.tmpdir, name), (1, 1))
+        cache.load('http://0')
+        cache.store('http://3', body, {}, when=3)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 3)
+        self.assertEqual(cache.load('http://1'), None)
+        for i in (0, 2, 3):
+            self.assertEqual(cache.load('http://{}'.format(i))[0], body)
+
+
+class TestCompression(unittest.TestCase):
+    def testSavedPath(self):
+        existing = set(['a.html.gz', 'b.html', 'c.gz'])
+        for dest, compress, found in (('a.html', 'none', 'a.html.gz'),
+                                      ('a.html.gz', 'gzip', 'a.html.gz'),
+                                      ('b.html.gz', 'gzip', 'b.html'),
+                                      ('c.html', 'none', None),
+                                      ('c.html.gz', 'gzip', None),
+                                      # ext = gz, not compressed
+                                      ('c.gz', 'none', 'c.gz'),
+                                      ('b.gz', 'none', None)):
+            self.assertEqual(feedretrieve.saved_path(
+                    dest, existing.__contains__, compress), found)
+
+
+class TestDirListing(unittest.TestCase):
+    def testListing(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            names = [random_string(10) for _ in range(20)]
+            for name in names[:10]:
+                open(os.path.join(tmpdir, name), 'w').close()
+            listing = feedretrieve.DirListing()
+            for name in names[:10]:
+                self.assertTrue(listing.exists(os.path.join(tmpdir, name)))
+            for name in names[10:]:
+                path = os.path.join(tmpdir, name)
+                self.assertFalse(listing.exists(path))
+                open(path, 'w').close()
+                # not read again...
+                self.assertFalse(listing.exists(path))
+                listing.add(path)
+                self.assertTrue(listing.exists(path))
+            # ...same dir, other path
+            self.assertTrue(listing.exists(
+                    os.path.join(tmpdir, '.', names[-1])))
+            os.remove(os.path.join(tmpdir, names[0]))
+            self.assertTrue(listing.exists(os.path.join(tmpdir, names[0])))
+            listing.clear()
+            self.assertFalse(listing.exists(os.path.join(tmpdir, names[0])))
+            self.assertFalse(listing.exists(
+                    os.path.join(tmpdir, 'nodir', names[1])))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 class TestRecovery(unittest.TestCase):
 
     def testWriteRecoveryEntries(self):
@@ -259,6 +895,76 @@ class TestRecovery(unittest.TestCase):
         finally:
             logging.getLogger().setLevel(logging.WARNING)
 
+    def testIterRecoveryEntries(self):
+        with tempfile.NamedTemporaryFile(delete=False) as out:
+            out.write(b'a\nb\n\nc\nd\n\na\nb\n\na\nc\n\nc\nd\n')
+        try:
+            self.assertEqual(list(feedretrieve.iter_recovery(out.name)),
+                             [('a', 'b', 'none'), ('c', 'd', 'none'),
+                              ('a', 'c', 'none')])
+            self.assertEqual(
+                len(list(feedretrieve.iter_recovery(out.name, False))), 5)
+        finally:
+            os.remove(out.name)
+
+    def testCompressedEntries(self):
+        with tempfile.NamedTemporaryFile(delete=False) as out:
+            pass
+        try:
+            feedretrieve.write_recovery_entry(out.name, 'a', 'a.gz', 'none')
+            feedretrieve.write_recovery_entry(out.name, 'b', 'b.gz', 'gzip')
+            feedretrieve.write_recovery_entry(out.name, 'c', 'c')
+            self.assertEqual(list(feedretrieve.iter_recovery(out.name)),
+                             [('a', 'a.gz', 'none'), ('b', 'b.gz', 'gzip'),
+                              ('c', 'c', 'none')])
+            self.assertEqual(feedretrieve.read_recovery(out.name),
+                             ([('a', 'a.gz'), ('b', 'b.gz'), ('c', 'c')],
+                              []))
+        finally:
+            os.remove(out.name)
+
+    def testRecover(self):
+        logging.disable(logging.ERROR)
+        tmpdir = tempfile.mkdtemp()
+        batch_size = feedretrieve.RecoveryWriter.batch_size
+        try:
+            recfile = os.path.join(tmpdir, 'failed')
+            saved = os.path.join(tmpdir, 'saved')
+            open(saved, 'w').close()
+            failing = [('http://127.0.0.1:1/{}'.format(i),
+                        os.path.join(tmpdir, str(i))) for i in range(5)]
+            for url, path in failing * 3 + [('http://127.0.0.1:1/', saved)]:
+                feedretrieve.write_recovery_entry(recfile, url, path)
+            feedretrieve.RecoveryWriter.batch_size = 2
+            with closing(feedretrieve.FeedRetriever(
+                    os.path.join(tmpdir, 'none.cfg'), recfile,
+                    timeout=5)) as retriever:
+                retriever.recover()
+                data, errors = feedretrieve.read_recovery(recfile)
+                self.assertEqual(data, failing)
+                self.assertEqual(os.listdir(tmpdir).count('failed.new'), 0)
+                # a bad destination doesn't block the others
+                os.remove(recfile)
+                bad = ('http://127.0.0.1:1/x',
+                       os.path.join(tmpdir, 'nodir', 'x'))
+                feedretrieve.write_recovery_entry(recfile, *bad)
+                feedretrieve.write_recovery_entry(recfile, *failing[0])
+                retriever.breaker.success('127.0.0.1:1')
+                retriever.recover()
+                self.assertEqual(feedretrieve.read_recovery(recfile)[0],
+                                 [bad, failing[0]])
+                self.assertEqual(
+                    retriever.breaker._failures.get('127.0.0.1:1'), 1)
+                open(failing[0][1], 'w').close()
+                os.remove(recfile)
+                feedretrieve.write_recovery_entry(recfile, *failing[0])
+                retriever.recover()
+                self.assertFalse(os.path.exists(recfile))
+        finally:
+            feedretrieve.RecoveryWriter.batch_size = batch_size
+            logging.disable(logging.NOTSET)
+            shutil.rmtree(tmpdir)
+
 
 class TestPlugin(unittest.TestCase):
     def testImportPlugin(self):